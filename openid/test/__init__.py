@@ -67,6 +67,7 @@ def pyUnitTests():
         'rpverify',
         'extension',
         'codecutil',
+        'yadis_manager',
     ]
 
     test_modules = [
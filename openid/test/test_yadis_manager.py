@@ -0,0 +1,168 @@
+import json
+import pickle
+import unittest
+
+from openid.consumer.discover import OpenIDServiceEndpoint
+from openid.yadis.manager import Discovery, YadisServiceManager
+
+
+class ManagerFromDictTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = YadisServiceManager('http://start.url/',
+                                           'http://yadis.url/', ['a', 'b'],
+                                           'key')
+
+    def test_roundTrip(self):
+        next(self.manager)
+        restored = Discovery._from_dict(self.manager.to_dict())
+        self.assertTrue(isinstance(restored, YadisServiceManager))
+        self.assertEqual('http://start.url/', restored.starting_url)
+        self.assertEqual('http://yadis.url/', restored.yadis_url)
+        self.assertEqual('key', restored.session_key)
+        self.assertEqual('a', restored.current())
+        self.assertEqual(1, len(restored))
+        self.assertEqual('b', next(restored))
+
+    def test_noSpuriousAttributes(self):
+        data = self.manager.to_dict()
+        data['server_url'] = 'http://server.url/'
+        restored = Discovery._from_dict(data)
+        self.assertFalse(hasattr(restored, 'server_url'))
+
+    def test_missingServices(self):
+        restored = Discovery._from_dict({'starting_url': 'http://start.url/'})
+        self.assertEqual(0, len(restored))
+        self.assertFalse(restored.started())
+
+    def test_cursorPastEnd(self):
+        restored = Discovery._from_dict({'_idx': 2, 'services': ['x']})
+        self.assertEqual(0, len(restored))
+        self.assertTrue(restored.is_exhausted())
+        self.assertRaises(StopIteration, next, restored)
+
+
+class LegacyPickleTest(unittest.TestCase):
+    # A session holding a manager pickled (protocol 2) by the old
+    # dict-based YadisServiceManager, after one call to next()
+    legacy = (
+        b'\x80\x02}q\x00(X\x05\x00\x00\x00otherq\x01K\x01X\x03\x00\x00'
+        b'\x00keyq\x02copenid.yadis.manager\nYadisServiceManager\nq\x03)'
+        b'\x81q\x04(X\x0c\x00\x00\x00starting_urlq\x05X\x11\x00\x00\x00'
+        b'http://start.url/q\x06X\t\x00\x00\x00yadis_urlq\x07X\x11\x00'
+        b'\x00\x00http://yadis.url/q\x08X\x08\x00\x00\x00servicesq\t]q'
+        b'\n(X\x01\x00\x00\x00bq\x0bX\x01\x00\x00\x00cq\x0ceX\x0b\x00'
+        b'\x00\x00session_keyq\rh\x02X\x08\x00\x00\x00_currentq\x0eX'
+        b'\x01\x00\x00\x00aq\x0fuu.')
+
+    def test_unpickleLegacy(self):
+        session = pickle.loads(self.legacy)
+        self.assertEqual(1, session['other'])
+        manager = session['key']
+        self.assertTrue(isinstance(manager, YadisServiceManager))
+        self.assertEqual('http://start.url/', manager.starting_url)
+        self.assertEqual('key', manager.session_key)
+        self.assertTrue(manager.forURL('http://yadis.url/'))
+        self.assertEqual('a', manager.current())
+        self.assertEqual(2, len(manager))
+        self.assertEqual('b', next(manager))
+
+    def test_legacyStoredAsDict(self):
+        session = pickle.loads(self.legacy)
+        manager = session['key']
+        next(manager)
+        manager.store(session)
+        self.assertTrue(type(session['key']) is dict)
+        restored = Discovery._from_dict(session['key'])
+        self.assertEqual('b', restored.current())
+        self.assertEqual(['c'], list(restored))
+
+    def test_unknownKey(self):
+        manager = YadisServiceManager(None, None, (), None)
+        self.assertRaises(KeyError, manager.__setitem__, 'server_url', None)
+
+
+class ForURLTest(unittest.TestCase):
+    def test_settersUpdateURLs(self):
+        manager = YadisServiceManager('http://start.url/',
+                                      'http://yadis.url/', ['a'], 'key')
+        manager.yadis_url = 'http://other.url/'
+        self.assertTrue(manager.forURL('http://other.url/'))
+        self.assertFalse(manager.forURL('http://yadis.url/'))
+        manager.starting_url = 'http://new.url/'
+        self.assertTrue(manager.forURL('http://new.url/'))
+        self.assertFalse(manager.forURL('http://start.url/'))
+
+
+class StoreTest(unittest.TestCase):
+    def test_storesPlainDict(self):
+        session = {}
+        manager = YadisServiceManager('http://start.url/', None,
+                                      [{'server_url': 'http://server.url/'}],
+                                      'key')
+        next(manager)
+        manager.store(session)
+        self.assertTrue(type(session['key']) is dict)
+
+        restored = Discovery._from_dict(json.loads(json.dumps(session['key'])))
+        self.assertEqual({'server_url': 'http://server.url/'},
+                         restored.current())
+        self.assertEqual(0, len(restored))
+
+    def test_endpointInMemory(self):
+        session = {}
+        endpoint = OpenIDServiceEndpoint()
+        endpoint.server_url = 'http://server.url/'
+        discovery = Discovery(session, 'http://start.url/')
+        self.assertTrue(discovery.getNextService(
+            lambda url: (url, [endpoint])) is endpoint)
+        self.assertTrue(discovery.cleanup() is endpoint)
+        self.assertEqual({}, session)
+
+    def test_endpointJSONRoundTrip(self):
+        session = {}
+        endpoint = OpenIDServiceEndpoint()
+        endpoint.server_url = 'http://server.url/'
+        discovery = Discovery(session, 'http://start.url/')
+        discovery.getNextService(lambda url: (url, [endpoint]))
+
+        key = discovery.getSessionKey()
+        session[key] = json.loads(json.dumps(session[key]))
+        service = Discovery(session, 'http://start.url/').cleanup()
+        # The session decodes the endpoint as a plain dict
+        self.assertTrue(type(service) is dict)
+        self.assertEqual(dict(endpoint), service)
+
+
+class GetManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.session = {}
+        self.discovery = Discovery(self.session, 'http://start.url/')
+
+    def test_restoredAfterStore(self):
+        self.assertEqual('a', self.discovery.getNextService(
+            lambda url: ('http://yadis.url/', ['a', 'b'])))
+        manager = self.discovery.getManager()
+        self.assertEqual('a', manager.current())
+        self.assertEqual('b', self.discovery.getNextService(None))
+        self.assertEqual('b', self.discovery.getManager().current())
+
+    def test_exhaustedRediscovers(self):
+        self.discovery.createManager(['a'], 'http://yadis.url/')
+        self.assertEqual('a', self.discovery.getNextService(None))
+        self.assertTrue(self.discovery.getManager().is_exhausted())
+        self.assertEqual('c', self.discovery.getNextService(
+            lambda url: ('http://yadis.url/', ['c'])))
+
+    def test_nothingDiscovered(self):
+        self.assertTrue(
+            self.discovery.getNextService(lambda url: (url, [])) is None)
+        self.assertEqual({}, self.session)
+
+    def test_nothingDiscoveredGenerator(self):
+        self.assertTrue(self.discovery.getNextService(
+            lambda url: (url, (s for s in []))) is None)
+        self.assertEqual({}, self.session)
+
+
+if __name__ == '__main__':
+    unittest.main()
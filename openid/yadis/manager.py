@@ -1,66 +1,110 @@
-class YadisServiceManager(dict):
+import sys
+
+
+class YadisServiceManager(object):
     """Holds the state of a list of selected Yadis services, managing
     storing it in a session and iterating over the services in order."""
 
+    __slots__ = ('_starting_url', '_yadis_url', 'services', 'session_key',
+                 '_current', '_idx', '_urls')
+
+    # The keys used when this class was a dict subclass
+    _LEGACY_KEYS = ('starting_url', 'yadis_url', 'services', 'session_key',
+                    '_current')
+
     def __init__(self, starting_url, yadis_url, services, session_key):
-        # starting_url: The URL that was used to initiate the Yadis protocol
-        # yadis_url: The URL after following redirects (the identifier)
-        # services: List of service elements
-        # session_key: The session key to be used
-        # _current: Reference to the current service object
-        dict.__init__(
-            self,
-            starting_url=starting_url,
-            yadis_url=yadis_url,
-            services=list(services),
-            session_key=session_key,
-            _current=None
-        )
-
-    # Getters and setters for the above
+        # The URL that was used to initiate the Yadis protocol
+        self._starting_url = starting_url
+
+        # The URL after following redirects (the identifier)
+        self._yadis_url = yadis_url
+
+        # Both of the above, for forURL; kept up to date by the setters
+        self._urls = frozenset((starting_url, yadis_url))
+
+        # Tuple of service elements; it is never mutated, progress
+        # through it is tracked by _idx
+        self.services = tuple(services)
+
+        self.session_key = session_key
+
+        # Reference to the current service object
+        self._current = None
+
+        # Index of the next service to be returned
+        self._idx = 0
+
     @property
     def starting_url(self):
-        return self["starting_url"]
+        return self._starting_url
 
     @starting_url.setter
     def starting_url(self, value):
-        self["starting_url"] = value
+        self._starting_url = value
+        self._urls = frozenset((value, self._yadis_url))
 
     @property
     def yadis_url(self):
-        return self["yadis_url"]
+        return self._yadis_url
 
     @yadis_url.setter
     def yadis_url(self, value):
-        self["yadis_url"] = value
+        self._yadis_url = value
+        self._urls = frozenset((self._starting_url, value))
 
-    @property
-    def services(self):
-        return self["services"]
+    def to_dict(self):
+        """Return the state of this manager as a plain dict, suitable
+        for storing in a session.
 
-    @services.setter
-    def services(self, value):
-        self["services"] = list(value)
+        @rtype: dict
+        """
+        return {
+            'starting_url': self.starting_url,
+            'yadis_url': self.yadis_url,
+            'services': self.services,
+            'session_key': self.session_key,
+            '_current': self._current,
+            '_idx': self._idx,
+        }
 
-    @property
-    def session_key(self):
-        return self["session_key"]
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a manager from the output of L{to_dict}.
 
-    @session_key.setter
-    def session_key(self, value):
-        self["session_key"] = value
+        @rtype: L{YadisServiceManager}
+        """
+        manager = cls(data.get('starting_url'), data.get('yadis_url'),
+                      data.get('services') or [], data.get('session_key'))
+        manager._current = data.get('_current')
+        manager._idx = data.get('_idx', 0)
+        return manager
 
-    @property
-    def _current(self):
-        return self["_current"]
+    def __setitem__(self, key, value):
+        """Set a field by its old dict key.
 
-    @_current.setter
-    def _current(self, value):
-        self["_current"] = value
+        Managers pickled while this class was a dict subclass are
+        unpickled by calling this for each of their items, on an
+        instance that was created without calling __init__.
+        """
+        if key not in self._LEGACY_KEYS:
+            raise KeyError(key)
+
+        if not hasattr(self, '_idx'):
+            # First item: give every slot its default
+            self.__init__(None, None, (), None)
+
+        if key == 'services':
+            value = tuple(value)
+
+        setattr(self, key, value)
 
     def __len__(self):
         """How many untried services remain?"""
-        return len(self.services)
+        return max(0, len(self.services) - self._idx)
+
+    def is_exhausted(self):
+        """Have all of the services been returned?"""
+        return self._idx >= len(self.services)
 
     def __iter__(self):
         return self
@@ -70,12 +114,12 @@ class YadisServiceManager(dict):
 
         self.current() will continue to return that service until the
         next call to this method."""
-        try:
-            self._current = self.services.pop(0)
-        except IndexError:
+        if self._idx >= len(self.services):
             raise StopIteration
-        else:
-            return self._current
+
+        self._current = self.services[self._idx]
+        self._idx += 1
+        return self._current
 
     def current(self):
         """Return the current service.
@@ -85,15 +129,20 @@ class YadisServiceManager(dict):
         return self._current
 
     def forURL(self, url):
-        return url in [self.starting_url, self.yadis_url]
+        return url in self._urls
 
     def started(self):
         """Has the first service been returned?"""
         return self._current is not None
 
     def store(self, session):
-        """Store this object in the session, by its session key."""
-        session[self.session_key] = self
+        """Store this object in the session, by its session key.
+
+        The manager is stored as the plain dict returned by
+        L{to_dict}, so the session does not need to be able to pickle
+        arbitrary objects.
+        """
+        session[self.session_key] = self.to_dict()
 
 
 class Discovery(object):
@@ -106,7 +155,11 @@ class Discovery(object):
 
     @ivar session: a dict-like object that stores state unique to the
         requesting user-agent. This object must be able to store
-        serializable objects.
+        serializable objects. The service manager is stored as a plain
+        dict containing the discovered services, so those must be
+        serializable by the session too. A session that serializes
+        its values hands back the services in decoded form (plain
+        dicts for JSON), not as the objects that were stored.
 
     @ivar url: the URL that is used to make the discovery request
 
@@ -117,6 +170,8 @@ class Discovery(object):
     DEFAULT_SUFFIX = 'auth'
     PREFIX = '_yadis_services_'
 
+    __slots__ = ('session', 'url', 'session_key_suffix', '_session_key')
+
     def __init__(self, session, url, session_key_suffix=None):
         """Initialize a discovery object"""
         self.session = session
@@ -125,6 +180,7 @@ class Discovery(object):
             session_key_suffix = self.DEFAULT_SUFFIX
 
         self.session_key_suffix = session_key_suffix
+        self._session_key = sys.intern(self.PREFIX + self.session_key_suffix)
 
     def getNextService(self, discover):
         """Return the next authentication service for the pair of
@@ -132,7 +188,12 @@ class Discovery(object):
 
 
         @param discover: a callable that takes a URL and returns a
-            list of services
+            list of services. The services are stored in the session
+            as they are. If the session serializes its values (e.g. as
+            JSON), services come back from it as whatever it decodes
+            them to, so dict subclasses such as
+            C{openid.consumer.discover.OpenIDServiceEndpoint} are
+            returned as plain dicts rather than the original objects.
 
         @type discover: str -> [service]
 
@@ -140,19 +201,28 @@ class Discovery(object):
         @return: the next available service
         """
         manager = self.getManager()
-        if manager is not None and not manager:
-            self.destroyManager()
+        if manager is not None and manager.is_exhausted():
+            # getManager just found it in the session, for this URL
+            self._destroyManagerUnchecked()
+            manager = None
 
-        if not manager:
+        if manager is None:
             yadis_url, services = discover(self.url)
-            manager = self.createManager(services, yadis_url)
-
-        if manager:
-            service = next(manager)
-            manager.store(self.session)
-        else:
-            service = None
-
+            if not services:
+                return None
+
+            # Any manager for this URL was either absent or has just
+            # been destroyed, so there is no need to go through
+            # createManager. The manager is stored once it has been
+            # advanced below.
+            manager = YadisServiceManager(self.url, yadis_url, services,
+                                          self._session_key)
+            # services may have been an empty iterator, which is truthy
+            if manager.is_exhausted():
+                return None
+
+        service = next(manager)
+        manager.store(self.session)
         return service
 
     def cleanup(self, force=False):
@@ -169,7 +239,7 @@ class Discovery(object):
         manager = self.getManager(force=force)
         if manager is not None:
             service = manager.current()
-            self.destroyManager(force=force)
+            self._destroyManagerUnchecked()
         else:
             service = None
 
@@ -183,24 +253,11 @@ class Discovery(object):
         @return: The session key
         @rtype: str
         """
-        return self.PREFIX + self.session_key_suffix
+        return self._session_key
 
     @classmethod
     def _from_dict(cls, data):
-        newmanager = YadisServiceManager(
-            starting_url=data.get("starting_url", None),
-            yadis_url=data.get("yadis_url", None),
-            services=data.get("services", None),
-            session_key=data.get("session_key", None)
-        )
-        newmanager._current = data.get("_current", None),
-        newmanager.server_url = data.get("server_url", None),
-        newmanager.type_uris = data.get("type_uris", None),
-        newmanager.local_id = data.get("local_id", None),
-        newmanager.canonicalID = data.get("canonicalID", None),
-        newmanager.used_yadis = data.get("used_yadis", None),
-        newmanager.display_identifier = data.get("display_identifier", None)
-        return newmanager
+        return YadisServiceManager.from_dict(data)
 
     def getManager(self, force=False):
         """Extract the YadisServiceManager for this object's URL and
@@ -212,14 +269,16 @@ class Discovery(object):
         @return: The current YadisServiceManager, if it's for this
             URL, or else None
         """
-        manager = self.session.get(self.getSessionKey())
+        manager = self.session.get(self._session_key)
+        if manager is None:
+            return None
 
         # Handle the case where we only receive a dict, instead of a
         # full YadisServiceManager object
-        if(type(manager) == dict):
+        if isinstance(manager, dict):
             manager = self._from_dict(manager)
 
-        if (manager is not None and (manager.forURL(self.url) or force)):
+        if force or manager.forURL(self.url):
             return manager
         else:
             return None
@@ -255,5 +314,10 @@ class Discovery(object):
         of whether it's a manager for self.url.
         """
         if self.getManager(force=force) is not None:
-            key = self.getSessionKey()
-            del self.session[key]
+            self._destroyManagerUnchecked()
+
+    def _destroyManagerUnchecked(self):
+        """Delete the YadisServiceManager from the session without
+        checking which URL it is for. The caller must know it is there.
+        """
+        del self.session[self.getSessionKey()]